@@ -0,0 +1,214 @@
+"""
+@author: Abdelrahman Mahmoud Gaber
+@email: abdulrahman.mahmoud1995@gmail.com
+"""
+from commands import *
+
+from collections import deque
+
+# demodulation floor (dB) for each data rate, see CurrentADRMsg for the SF/BW of each DR
+REQUIRED_SNR = {
+    CurrentADR.DR_0: -20.0, # SF12 BW125K
+    CurrentADR.DR_1: -17.5, # SF11 BW125K
+    CurrentADR.DR_2: -15.0, # SF10 BW125K
+    CurrentADR.DR_3: -12.5, # SF9 BW125K
+    CurrentADR.DR_4: -10.0, # SF8 BW125K
+    CurrentADR.DR_5: -7.5,  # SF7 BW125K
+    CurrentADR.DR_6: -4.5,  # SF7 BW250K, 3dB less sensitive than DR_5
+    CurrentADR.DR_7: 5.0,   # FSK 50K
+}
+
+POWER_STEP_DB = 2.0 # CurrentPower steps are 2dB apart
+
+
+class RateController:
+
+    def __init__(self, lora, adr_enabled=False, margin=10.0, hysteresis=3.0, window=8, max_loss=0.25,
+                 dr=CurrentADR.DR_0, power=CurrentPower.DBm_16,
+                 min_dr=CurrentADR.DR_0, max_dr=CurrentADR.DR_5, min_power=CurrentPower.DBm_2):
+        """
+        Client side data rate and TX power control from ^LRCONFIRM/^LRRECV link feedback.
+
+        The listener only records feedback and updates recommendation, the owner of the Lora connection
+        calls apply() to write it (a listener runs while another command may be waiting for its response).
+
+        .. NOTE::
+            RSSI/SNR in the reports are measured by the module on the downlink, they are used as an
+            estimate of the uplink budget. A margin of 10dB (same as the network server ADR) covers that.
+
+        :param lora: Lora object, the controller registers itself as listener
+        :param adr_enabled: True if ADREN is enabled, then the controller only cross-checks the uplink DR
+            the network chose (dr of ^LRSEND)
+        :param margin: installation margin (dB) kept above the demodulation floor
+        :param hysteresis: extra margin (dB) needed before changing DR or power in either direction
+        :param window: number of reports used for every decision
+        :param max_loss: loss ratio of confirmed uplinks above which DR is lowered
+        :param dr: current data rate (CURRENTDR)
+        :param power: current TX power (CURRENTPW)
+        :param min_dr, max_dr: data rate range the controller may use
+        :param min_power: lowest TX power the controller may use
+        """
+        self._lora = lora
+        self.adr_enabled = adr_enabled
+        self._margin = margin
+        self._hysteresis = hysteresis
+        self._max_loss = max_loss
+        self._min_dr = CurrentADR(min_dr)
+        self._max_dr = CurrentADR(max_dr)
+        self._min_power = CurrentPower(min_power)
+        self.dr = CurrentADR(dr)
+        self.power = CurrentPower(power)
+        self._snr = deque(maxlen=window)
+        self._rssi = deque(maxlen=window)
+        self._deliveries = deque(maxlen=window) # True/False per confirmed uplink
+        self.recommendation = (self.dr, self.power) # latest decision, also kept when adr_enabled
+        lora.add_listener(self.feed)
+
+    def feed(self, line):
+        """
+        Lora listener, take RSSI/SNR from ^LRCONFIRM/^LRRECV and the uplink DR from ^LRSEND.
+        """
+
+        try:
+            command = Command.parse(line)
+        except (CommandError, CommandNotFoundError, IndexError, ValueError):
+            return
+        if command is not None and command._mode == REPORT:
+            self.observe(command)
+
+    def observe(self, command):
+        """
+        Add a parsed report and re-evaluate the recommendation.
+
+        :returns: new recommendation (dr, power) if it changed, None otherwise
+        """
+
+        if command.base_name == "LRSEND":
+            # dr of ^LRRECV/^LRCONFIRM is the downlink one (RX1 offset or RX2), ^LRSEND has the uplink DR
+            if self.adr_enabled and command.dr in CurrentADRMsg:
+                self.dr = CurrentADR(command.dr) # network decides, follow what it uses
+                return self._recommend()
+            return None
+        if command.base_name not in ("LRCONFIRM", "LRRECV"):
+            return None
+        self._snr.append(command.snr)
+        self._rssi.append(command.rssi)
+        if command.base_name == "LRCONFIRM":
+            self._deliveries.append(True)
+        return self._recommend()
+
+    def record_delivery(self, handle):
+        """
+        Count a ConfirmedUplink that timed out as lost (confirmed ones are counted by observe).
+        """
+
+        if handle.timed_out:
+            self._deliveries.append(False)
+            return self._recommend()
+        return None
+
+    @property
+    def loss(self):
+        if not self._deliveries:
+            return 0.0
+        return self._deliveries.count(False) / len(self._deliveries)
+
+    @property
+    def link_margin(self):
+        """
+        Best SNR in the window above the current DR floor and the installation margin (dB).
+        """
+
+        if not self._snr:
+            return None
+        return max(self._snr) - REQUIRED_SNR[self.dr] - self._margin
+
+    def decide(self):
+        """
+        Return the (dr, power) the link should use, without applying it.
+        """
+
+        dr, power = self.dr, self.power
+        # a single lost frame right after a change is not enough to go back
+        if len(self._deliveries) >= self._deliveries.maxlen // 2 and self.loss > self._max_loss:
+            # losing frames, get more power first then a more robust DR
+            if power > CurrentPower.DBm_16:
+                return dr, CurrentPower(power - 1)
+            return CurrentADR(max(dr - 1, self._min_dr)), power
+
+        if len(self._snr) < self._snr.maxlen:
+            return dr, power
+
+        margin = self.link_margin
+        if margin >= self._hysteresis:
+            # one DR at a time, the floors aren't evenly spaced (DR_6 -> DR_7 alone takes 9.5dB)
+            while dr < self._max_dr and margin >= REQUIRED_SNR[dr + 1] - REQUIRED_SNR[dr]:
+                margin -= REQUIRED_SNR[dr + 1] - REQUIRED_SNR[dr]
+                dr = CurrentADR(dr + 1)
+            # still margin at the fastest DR, lower TX power
+            while dr == self._max_dr and margin >= POWER_STEP_DB and power < self._min_power:
+                margin -= POWER_STEP_DB
+                power = CurrentPower(power + 1)
+        elif margin <= -self._hysteresis:
+            # get more power first, then a more robust DR, until the margin is back
+            while margin < 0 and power > CurrentPower.DBm_16:
+                margin += POWER_STEP_DB
+                power = CurrentPower(power - 1)
+            while margin < 0 and dr > self._min_dr:
+                margin += REQUIRED_SNR[dr] - REQUIRED_SNR[dr - 1]
+                dr = CurrentADR(dr - 1)
+        return dr, power
+
+    def _recommend(self):
+        """
+        Update recommendation, nothing is sent to the module here.
+
+        :returns: new recommendation if it changed, None otherwise
+        """
+
+        recommendation = self.decide()
+        if recommendation == self.recommendation:
+            return None
+        self.recommendation = recommendation
+        if self.adr_enabled and recommendation != (self.dr, self.power) and self._lora._debug:
+            print("INFO: Network ADR uses {}, link feedback suggests {}".format(
+                CurrentADRMsg[self.dr], CurrentADRMsg[recommendation[0]]))
+        return recommendation
+
+    def _set(self, name, value):
+        # the field is called "mode" which clashes with Command's mode argument, set it afterwards
+        command = Command(name, SET)
+        command.mode = int(value)
+        Command.check_response(self._lora.query(command), name)
+
+    def apply(self):
+        """
+        Write the recommendation to the module (CURRENTDR/CURRENTPW) when ADR is disabled.
+        Call it from the thread using the Lora connection, not from a listener.
+
+        :returns: (dr, power) if changed, None otherwise
+        :raises ResponseError: the module rejected the setting (it is kept as recommendation)
+        """
+
+        dr, power = self.recommendation
+        if self.adr_enabled or (dr, power) == (self.dr, self.power):
+            return None
+
+        changed = False
+        try:
+            if dr != self.dr:
+                self._set("CURRENTDR", dr)
+                self.dr, changed = dr, True
+            if power != self.power:
+                self._set("CURRENTPW", power)
+                self.power, changed = power, True
+        finally:
+            if changed:
+                # start over so the next decision is made on feedback at the new settings
+                self._snr.clear()
+                self._rssi.clear()
+                self._deliveries.clear()
+        return dr, power
+
+    def close(self):
+        self._lora.remove_listener(self.feed)
@@ -0,0 +1,463 @@
+"""
+@author: Abdelrahman Mahmoud Gaber
+@email: abdulrahman.mahmoud1995@gmail.com
+"""
+from commands import *
+
+from collections import deque
+import os
+import queue
+import re
+import selectors
+import socket
+import struct
+import threading
+import time
+
+"""
+Frames exchanged over the unix socket: length u32, type u8, request id u32, payload (little endian).
+FRAME_RESPONSE/FRAME_ERROR carry the id of the request they answer, other frames use 0.
+
+    FRAME_REQUEST   client -> broker  serialized AT command (e.g. b"AT+STATUS=?\\r\\n")
+    FRAME_RESPONSE  broker -> client  lines the module answered to the request, joined
+    FRAME_SUBSCRIBE client -> broker  comma separated report names (e.g. b"LRRECV,LRCONFIRM"), empty for all
+    FRAME_REPORT    broker -> client  one unsolicited line (e.g. b"^LRRECV:...\\r\\n")
+    FRAME_ERROR     broker -> client  error message
+"""
+
+FRAME_HEADER = struct.Struct("<IBI")
+
+# frame types, prefixed so they don't shadow the command modes (e.g. REPORT) from commands
+FRAME_REQUEST = 1
+FRAME_RESPONSE = 2
+FRAME_SUBSCRIBE = 3
+FRAME_REPORT = 4
+FRAME_ERROR = 5
+
+FRAME_MAX = 1 << 16 # AT lines are far below this, anything bigger is a broken client
+
+
+def _frame(frame_type, payload=b"", request_id=0):
+    return FRAME_HEADER.pack(len(payload), frame_type, request_id) + payload
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def _recv_frame(sock):
+    length, frame_type, request_id = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    if length > FRAME_MAX:
+        raise ConnectionError("Frame too big {length}".format(length=length))
+    return frame_type, request_id, _recv_exact(sock, length)
+
+
+def _report_name(line):
+    match = re.match(COMMAND_REGEX, line.decode("utf-8", "replace"))
+    if match is None:
+        match = re.match(COMMAND_CHANNEL_REGEX, line.decode("utf-8", "replace"))
+    return match.groups()[0] if match else None
+
+
+class _BrokerClient:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray() # partial frame
+        self.requests = deque() # (request id, payload)
+        self.reports = None # None: not subscribed, empty set: all reports
+        self.send_lock = threading.Lock()
+
+    def send(self, data):
+        with self.send_lock:
+            self.sock.sendall(data)
+
+
+class LoraBroker:
+
+    def __init__(self, lora, path, send_timeout=1.0, interval=0.01):
+        """
+        Own the Lora connection and share it with local processes over a unix domain socket.
+
+        Requests are served one at a time, round robin between clients, so a busy client can't starve
+        the others. Unsolicited reports are framed once and the same buffer is sent to every subscriber.
+
+        :param lora: connected Lora object
+        :param path: unix socket path (removed and created again)
+        :param send_timeout: a subscriber that can't take a frame within this time is disconnected
+        :param interval: polling interval of the serial port when idle
+        """
+        self._lora = lora
+        self._path = path
+        self._send_timeout = send_timeout
+        self._interval = interval
+        self._clients = {} # socket -> _BrokerClient
+        self._order = deque() # round robin order of clients with requests
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._selector = selectors.DefaultSelector()
+        self._server = None
+        self._running = False
+        self._threads = []
+        lora.add_listener(self._publish)
+
+    def start(self):
+        """
+        Start serving in background threads.
+        """
+
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._path)
+        self._server.listen()
+        self._server.setblocking(False)
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._accept_loop, daemon=True),
+            threading.Thread(target=self._serial_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        if self._lora._debug:
+            print("INFO: Broker listening on {}".format(self._path))
+
+    def serve_forever(self):
+        self.start()
+        try:
+            for thread in self._threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        self._running = False
+        with self._lock:
+            self._work.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+        for client in list(self._clients.values()):
+            self._drop(client)
+        if self._server is not None:
+            self._selector.unregister(self._server)
+            self._server.close()
+            self._server = None
+            os.unlink(self._path)
+        self._lora.remove_listener(self._publish)
+
+    def _drop(self, client):
+        with self._lock:
+            if self._clients.pop(client.sock, None) is None:
+                return
+            if client in self._order:
+                self._order.remove(client)
+        try:
+            self._selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def _accept_loop(self):
+        while self._running:
+            for key, _ in self._selector.select(timeout=0.1):
+                if key.fileobj is self._server:
+                    try:
+                        sock, _ = self._server.accept()
+                    except OSError as err: # e.g. out of file descriptors, keep serving the others
+                        print("Error accepting broker client {}".format(err))
+                        continue
+                    sock.settimeout(self._send_timeout)
+                    client = _BrokerClient(sock)
+                    with self._lock:
+                        self._clients[sock] = client
+                    self._selector.register(sock, selectors.EVENT_READ, client)
+                    continue
+                try:
+                    self._read(key.data)
+                except Exception as err: # bad input of one client must not stop the broker
+                    print("Error reading broker client {}".format(err))
+                    self._drop(key.data)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(client)
+            return
+        client.buffer += data
+        while len(client.buffer) >= FRAME_HEADER.size:
+            length, frame_type, request_id = FRAME_HEADER.unpack_from(client.buffer)
+            if length > FRAME_MAX:
+                self._drop(client)
+                return
+            if len(client.buffer) < FRAME_HEADER.size + length:
+                break
+            payload = bytes(client.buffer[FRAME_HEADER.size:FRAME_HEADER.size + length])
+            del client.buffer[:FRAME_HEADER.size + length]
+            if frame_type == FRAME_REQUEST:
+                with self._lock:
+                    client.requests.append((request_id, payload))
+                    if client not in self._order:
+                        self._order.append(client)
+                    self._work.notify()
+            elif frame_type == FRAME_SUBSCRIBE:
+                client.reports = set(name for name in payload.decode("utf-8", "replace").split(",") if name)
+
+    def _next_request(self):
+        """
+        Take one request from the client at the head of the round robin and move it to the back.
+        """
+
+        with self._lock:
+            if not self._order:
+                self._work.wait(self._interval)
+            if not self._order:
+                return None, None
+            client = self._order.popleft()
+            request = client.requests.popleft()
+            if client.requests:
+                self._order.append(client)
+            return client, request
+
+    def _serial_loop(self):
+        while self._running:
+            client, request = self._next_request()
+            try:
+                if client is None:
+                    self._lora.poll() # idle, forward reports
+                    continue
+                request_id, data = request
+                # reports read meanwhile go to the listeners (_publish), not into the response
+                response = self._lora.query_raw(data)[0]
+                frame = _frame(FRAME_RESPONSE, b"".join(response), request_id)
+            except Exception as err: # serial errors are sent to the client, the broker keeps running
+                if client is None:
+                    print("Error reading serial port {}".format(err))
+                    continue
+                frame = _frame(FRAME_ERROR, str(err).encode(), request_id)
+            try:
+                client.send(frame)
+            except OSError:
+                self._drop(client)
+
+    def _publish(self, line):
+        """
+        Lora listener, send the report to subscribed clients.
+        """
+
+        name = _report_name(line)
+        frame = memoryview(_frame(FRAME_REPORT, line)) # built once, shared by all subscribers
+        with self._lock:
+            clients = [client for client in self._clients.values() if client.reports is not None and
+                       (not client.reports or name in client.reports)]
+        for client in clients:
+            try:
+                client.send(frame)
+            except OSError: # slow or gone, don't let it hold the serial port
+                self._drop(client)
+
+
+class LoraClient:
+
+    def __init__(self, path, timeout=5.0, debug=True):
+        """
+        Lora compatible client of a LoraBroker.
+
+        .. NOTE::
+            Listeners run on a dispatcher thread of their own, they may send commands (the response
+            is delivered by the reader thread).
+
+        :param path: unix socket path of the broker
+        :param timeout: seconds to wait for the response of a request
+        :param debug: print connection info
+        """
+        self._path = path
+        self._timeout = timeout
+        self._debug = debug
+        self._sock = None
+        self._connected = False
+        self._reader = None
+        self._dispatcher = None
+        self._responses = queue.Queue() # (frame type, request id, payload)
+        self._reports = queue.Queue() # report lines for the dispatcher thread, None stops it
+        self._lines = deque() # response lines waiting for readline()/readlines()
+        self._listeners = []
+        self._request_id = 0
+        self._request_lock = threading.Lock() # one request waiting for its response at a time
+        self._send_lock = threading.Lock() # frames written whole, never interleaved
+        self._status = StatusNetwork.RESET
+
+    def __del__(self):
+        self.disconnect()
+
+    @property
+    def status(self):
+        return self._status
+
+    def connect(self):
+        """
+        Connect to the broker.
+        """
+
+        self._connected = False
+        # start clean, the previous connection may have left its "Connection closed" error or lines behind
+        self._responses = queue.Queue()
+        self._reports = queue.Queue()
+        self._lines.clear()
+        try:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(self._path)
+            self._connected = True
+            # the threads keep the queues of their own connection, a late exit can't reach a new one
+            self._reader = threading.Thread(target=self._read_loop, daemon=True,
+                                            args=(self._sock, self._responses, self._reports))
+            self._reader.start()
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, args=(self._reports,), daemon=True)
+            self._dispatcher.start()
+            if self._listeners:
+                self.subscribe()
+            if self._debug:
+                print("INFO: Connected Successfully to broker: {}".format(self._path))
+        except OSError as err:
+            print(f"Error connecting to broker {err}")
+        return self._connected
+
+    def disconnect(self):
+        if self._connected and self._sock:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+                self._sock.close()
+            except OSError as err:
+                print(f"Error disconnecting from broker {err}")
+        self._connected = False
+        return self._connected
+
+    def _read_loop(self, sock, responses, reports):
+        try:
+            while True:
+                frame_type, request_id, payload = _recv_frame(sock)
+                if frame_type == FRAME_REPORT:
+                    reports.put(payload)
+                else:
+                    responses.put((frame_type, request_id, payload))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if self._sock is sock: # not reconnected meanwhile
+                self._connected = False
+            responses.put((FRAME_ERROR, 0, b"Connection closed")) # id 0 wakes any request
+            reports.put(None)
+
+    def _dispatch_loop(self, reports):
+        while True:
+            line = reports.get()
+            if line is None:
+                return
+            self.dispatch([line])
+
+    def _send_frame(self, frame):
+        with self._send_lock:
+            self._sock.sendall(frame)
+
+    def subscribe(self, reports=()):
+        """
+        Receive reports (e.g. ("LRRECV", "LRCONFIRM")) through the listeners, all reports by default.
+        """
+
+        self._send_frame(_frame(FRAME_SUBSCRIBE, ",".join(reports).encode()))
+
+    def add_listener(self, listener):
+        first = not self._listeners
+        self._listeners.append(listener)
+        if first and self._connected:
+            self.subscribe()
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def dispatch(self, lines):
+        for line in lines:
+            for listener in list(self._listeners):
+                try:
+                    listener(line)
+                except Exception as err: # a broken listener must not stop the others
+                    print("Error in listener {}: {}".format(listener, err))
+
+    def poll(self):
+        """
+        Reports are pushed by the broker and dispatched by the dispatcher thread, nothing to read here.
+        """
+
+        return 0
+
+    def _request(self, data):
+        """
+        Send data as a request and return the response lines.
+        """
+
+        with self._request_lock:
+            self._request_id = self._request_id % 0xFFFFFFFF + 1 # 0 is never used by a request
+            request_id = self._request_id
+            self._send_frame(_frame(FRAME_REQUEST, data, request_id))
+            deadline = time.monotonic() + self._timeout
+            while True:
+                try:
+                    frame_type, frame_id, payload = self._responses.get(
+                        timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise ResponseError("No response from broker")
+                if frame_id in (request_id, 0):
+                    break
+                # late answer of a request that timed out, drop it
+            if frame_type == FRAME_ERROR:
+                raise CommandError(payload.decode())
+            return payload.splitlines(keepends=True)
+
+    def send(self, data):
+        """
+        Send raw bytes as a request, the response lines are kept for readline()/readlines().
+        """
+
+        self._lines.extend(self._request(data))
+
+    def send_raw_command(self, command):
+        """
+        Send command through the broker.
+
+        param: command: Command
+        """
+
+        self.send(command.serialize().encode())
+
+    def query(self, command):
+        """
+        Send command and return its response lines (see Lora.query).
+        """
+
+        return self._request(command.serialize().encode())
+
+    def query_many(self, commands):
+        return [self.query(command) for command in commands]
+
+    def readline(self):
+        return self._lines.popleft() if self._lines else b""
+
+    def readlines(self):
+        lines = list(self._lines)
+        self._lines.clear()
+        return lines
+
+    @property
+    def is_available(self):
+        return len(self._lines)
@@ -160,6 +160,40 @@ class Command:
         payload = command_str[payload_index:].split(",")
         return command_name, command_mode, payload
 
+    @staticmethod
+    def is_final(line):
+        """
+        Check if line ends the response of a command (OK or ERROR).
+
+        :param line: line received from the device (bytes)
+        """
+
+        line = line.strip()
+        return line == OK_STR.encode() or line.lstrip(b"+").startswith(ERROR_STR.encode())
+
+    @staticmethod
+    def check_response(lines, name=None):
+        """
+        Raise ResponseError unless the response ends with OK (or, when name is given, echoes the command).
+
+        :param lines: response lines of the command (e.g. Lora.query output)
+        :param name: command name (e.g. MULTICAST3)
+        :returns: lines
+        """
+
+        for line in lines:
+            line = line.strip()
+            if line == OK_STR.encode():
+                return lines
+            if line.lstrip(b"+").startswith(ERROR_STR.encode()):
+                code = line.rpartition(b":")[2].strip()
+                code = int(code) if code.isdigit() else None
+                raise ResponseError("{name} failed: {msg}".format(
+                    name=name, msg=ErrorMsg.get(code, line.decode("utf-8", "replace"))), code)
+            if name is not None and line.startswith("+{name}:".format(name=name).encode()):
+                return lines
+        raise ResponseError("No response to {name}".format(name=name))
+
     @staticmethod
     def parse(command_str):
         """
@@ -201,54 +235,56 @@ class Command:
     def __repr__(self):
         return self.__str__()
 
-#%% Testing from payload (for msg recived)
-# command_raw = b"^LRRECV:1,22,-44,29,2,<ABCD,923.2,2\r\n"
-# command_raw = "^LRJOIN:481.5,0"
-# command_raw = "^LRCONFIRM:1,-128,10,481.5,0"
-# name, mode, payload = Command.command_check(command_raw) 
-# print("name: ", name, "\nmode: ", mode, "\npayload: ", payload)
-# lrrecv = Command.parse(command_raw)
-# print(lrrecv)
-# print(lrrecv["data"])
 
-#%%
-# AT+MULTICAST0=1,0xFFFFFFFF,>FEEDDCC8C7FC6CBC33D0809FB565001,>F Set the multicast address
-# EEDDCC8C7FC6CBC33D0809FB565002,0
-multicast = Command("MULTICAST25", GET, s=1, addr="0xFFFFFFFF", appskey=">FEEDDCC8C7FC6CBC33D0809FB565001", nwkskey=">FEEDDCC8C7FC6CBC33D0809FB565002", seq=0)
-multicast.serialize()
+if __name__ == "__main__":
+    #%% Testing from payload (for msg recived)
+    # command_raw = b"^LRRECV:1,22,-44,29,2,<ABCD,923.2,2\r\n"
+    # command_raw = "^LRJOIN:481.5,0"
+    # command_raw = "^LRCONFIRM:1,-128,10,481.5,0"
+    # name, mode, payload = Command.command_check(command_raw) 
+    # print("name: ", name, "\nmode: ", mode, "\npayload: ", payload)
+    # lrrecv = Command.parse(command_raw)
+    # print(lrrecv)
+    # print(lrrecv["data"])
+
+    #%%
+    # AT+MULTICAST0=1,0xFFFFFFFF,>FEEDDCC8C7FC6CBC33D0809FB565001,>F Set the multicast address
+    # EEDDCC8C7FC6CBC33D0809FB565002,0
+    multicast = Command("MULTICAST25", GET, s=1, addr="0xFFFFFFFF", appskey=">FEEDDCC8C7FC6CBC33D0809FB565001", nwkskey=">FEEDDCC8C7FC6CBC33D0809FB565002", seq=0)
+    multicast.serialize()
 
-command_raw = b'+MULTICAST56:1,0xFFFFFFFF,>FFEEDDCC8C7FC6CBC33D0809FB565001,>FFEEDDCC8C7FC6CBC33D0809FB565002,0\r\n'
-multicast = Command.parse(command_raw)
-print(multicast)
-# lrconfirm = Command.construct_from_payload(name, mode, payload)
-# print(lrrecv.data)
-# print(vars(lrrecv))
+    command_raw = b'+MULTICAST56:1,0xFFFFFFFF,>FFEEDDCC8C7FC6CBC33D0809FB565001,>FFEEDDCC8C7FC6CBC33D0809FB565002,0\r\n'
+    multicast = Command.parse(command_raw)
+    print(multicast)
+    # lrconfirm = Command.construct_from_payload(name, mode, payload)
+    # print(lrrecv.data)
+    # print(vars(lrrecv))
 
-# #%% Testing 
-# lrsend = Command("LRSEND", SET, port=33, confirm=1, len=36, data="12396895")
+    # #%% Testing 
+    # lrsend = Command("LRSEND", SET, port=33, confirm=1, len=36, data="12396895")
 
-# print(lrsend.serialize())
-# vars(lrsend)
+    # print(lrsend.serialize())
+    # vars(lrsend)
 
-# lrnsend = Command("LRNSEND", SET)
-# status = Command("STATUS", GET)
-# print(status.serialize())
-# vars(lrsend)
+    # lrnsend = Command("LRNSEND", SET)
+    # status = Command("STATUS", GET)
+    # print(status.serialize())
+    # vars(lrsend)
 
-# device_class = Command("DEVCLASS", SET)
-# vars(device_class)
-# #%% Test serilzation
-# lrsend = Command("LRSEND", SET, port=33, confirm=0, len=33, data="<abcdef")
-# print(lrsend.serialize())
+    # device_class = Command("DEVCLASS", SET)
+    # vars(device_class)
+    # #%% Test serilzation
+    # lrsend = Command("LRSEND", SET, port=33, confirm=0, len=33, data="<abcdef")
+    # print(lrsend.serialize())
 
-# status = Command("STATUS", GET)
-# print(status.serialize())
+    # status = Command("STATUS", GET)
+    # print(status.serialize())
 
-# device_class = Command("DEVCLASS", SET)
-# print(device_class.serialize())
+    # device_class = Command("DEVCLASS", SET)
+    # print(device_class.serialize())
 
 
 
 
 
-# %%
+    # %%
@@ -0,0 +1,216 @@
+"""
+@author: Abdelrahman Mahmoud Gaber
+@email: abdulrahman.mahmoud1995@gmail.com
+"""
+from commands import *
+
+from collections import deque
+import heapq
+import itertools
+import threading
+import time
+
+TRIAL_TIMEOUT = 6.0 # seconds per trial, RX1 + RX2 + ACK_TIMEOUT with some margin
+
+
+class ConfirmedUplink:
+
+    def __init__(self, tracker, command, nbtrials, deadline):
+        """
+        Handle of one confirmed uplink, resolved by ^LRCONFIRM or expired after nbtrials.
+
+        .. NOTE::
+            Created by ConfirmTracker.send(), not meant to be built by the user.
+        """
+        self._tracker = tracker
+        self._event = threading.Event()
+        self.command = command
+        self.nbtrials = nbtrials
+        self.deadline = deadline
+        self.sent_at = time.monotonic()
+        self.seq = None # known once ^LRSEND is reported
+        self.confirm = None # ^LRCONFIRM Command once confirmed
+        self.confirmed_at = None
+        self.error = None # ResponseError if the module rejected the command
+        self._timed_out = False
+
+    def _check_deadline(self):
+        if not self._event.is_set() and time.monotonic() >= self.deadline:
+            self._tracker.expire()
+
+    @property
+    def done(self):
+        """
+        True once confirmed, rejected or expired (checked against the deadline, no need to call expire()).
+        """
+
+        self._check_deadline()
+        return self._event.is_set()
+
+    @property
+    def timed_out(self):
+        self._check_deadline()
+        return self._timed_out
+
+    @property
+    def latency(self):
+        """
+        Seconds between send and ^LRCONFIRM or None if not confirmed.
+        """
+
+        if self.confirmed_at is None:
+            return None
+        return self.confirmed_at - self.sent_at
+
+    def _resolve(self, confirm):
+        self.confirm = confirm
+        self.confirmed_at = time.monotonic()
+        self._event.set()
+
+    def _expire(self):
+        self._timed_out = True
+        self._event.set()
+
+    def _fail(self, error):
+        self.error = error
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """
+        Block until confirmed or expired.
+
+        :returns: True if confirmed
+        """
+
+        end = self.deadline if timeout is None else min(self.deadline, time.monotonic() + timeout)
+        while not self._event.wait(max(0, end - time.monotonic())):
+            if time.monotonic() >= end:
+                break
+        self._tracker.expire()
+        return self.confirm is not None
+
+    def __str__(self):
+        state = ("CONFIRMED" if self.confirm is not None else "TIMEOUT" if self._timed_out else
+                 "ERROR" if self.error is not None else "PENDING")
+        return "ConfirmedUplink(seq={seq}, state={state}, latency={latency})".format(
+            seq=self.seq, state=state, latency=self.latency
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class ConfirmTracker:
+
+    def __init__(self, lora, trial_timeout=TRIAL_TIMEOUT, default_nbtrials=1):
+        """
+        Correlate confirmed LRSEND/LRNSEND uplinks with their ^LRCONFIRM report by seq.
+
+        :param lora: Lora object, the tracker registers itself as listener
+        :param trial_timeout: seconds allowed for each trial
+        :param default_nbtrials: trials assumed for LRSEND (LRNSEND carries its own nbtrials)
+        """
+        self._lora = lora
+        self._trial_timeout = trial_timeout
+        self._default_nbtrials = default_nbtrials
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock() # keeps _unassigned in the order the module gets the commands
+        self._unassigned = deque() # sent, waiting for ^LRSEND to report the seq (FIFO as the module)
+        self._outstanding = {} # seq -> ConfirmedUplink
+        self._expiry = [] # heap of (deadline, count, ConfirmedUplink)
+        self._counter = itertools.count()
+        lora.add_listener(self.feed)
+
+    def __len__(self):
+        with self._lock:
+            # expired handles are only dropped from _unassigned when the next ^LRSEND comes
+            unassigned = sum(not handle._event.is_set() for handle in self._unassigned)
+            return unassigned + len(self._outstanding)
+
+    def send(self, command):
+        """
+        Send a confirmed LRSEND/LRNSEND command and check the module accepted it.
+
+        :returns: ConfirmedUplink handle
+        :raises ResponseError: the module rejected the command (the handle is marked failed)
+        """
+
+        if command.base_name not in ("LRSEND", "LRNSEND") or command._mode != SET:
+            raise CommandError("Only LRSEND and LRNSEND SET commands can be tracked")
+        if int(command.confirm) != 1:
+            raise CommandError("Command is not a confirmed uplink (confirm=1)")
+        nbtrials = max(1, command.nbtrials) if command.base_name == "LRNSEND" else self._default_nbtrials
+        with self._send_lock:
+            handle = ConfirmedUplink(self, command, nbtrials, 0)
+            handle.deadline = handle.sent_at + nbtrials * self._trial_timeout
+            with self._lock: # registered first, ^LRSEND may come with the response
+                self._unassigned.append(handle)
+                heapq.heappush(self._expiry, (handle.deadline, next(self._counter), handle))
+            try:
+                Command.check_response(self._lora.query(command), command.base_name)
+            except ResponseError as err:
+                # rejected (e.g. queue full, not joined), no ^LRSEND will follow for it
+                with self._lock:
+                    if handle in self._unassigned:
+                        self._unassigned.remove(handle)
+                handle._fail(err)
+                raise
+        return handle
+
+    def feed(self, line):
+        """
+        Lora listener, handle ^LRSEND and ^LRCONFIRM reports.
+        """
+
+        try:
+            command = Command.parse(line)
+        except (CommandError, CommandNotFoundError, IndexError, ValueError):
+            return
+        if command is not None and command._mode == REPORT:
+            self.observe(command)
+        self.expire()
+
+    def observe(self, command):
+        """
+        Update the outstanding uplinks from a parsed report.
+        """
+
+        with self._lock:
+            if command.base_name == "LRSEND" and command.confirm == 1:
+                if self._unassigned:
+                    handle = self._unassigned.popleft()
+                    # the report belongs to the oldest uplink, if it expired meanwhile drop the report
+                    # rather than giving its seq (and later its ^LRCONFIRM) to the next one
+                    if not handle._event.is_set():
+                        handle.seq = command.seq
+                        self._outstanding[command.seq] = handle
+            elif command.base_name == "LRCONFIRM":
+                handle = self._outstanding.pop(command.seq, None)
+                if handle is not None:
+                    handle._resolve(command)
+
+    def expire(self):
+        """
+        Expire uplinks past their deadline.
+
+        :returns: list of expired handles
+        """
+
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, _, handle = heapq.heappop(self._expiry)
+                if handle._event.is_set():
+                    continue
+                if handle.seq is not None and self._outstanding.get(handle.seq) is handle:
+                    del self._outstanding[handle.seq]
+                handle._expire()
+                expired.append(handle)
+            # resolved handles are left in the heap, drop them once they reach the top
+            while self._expiry and self._expiry[0][2]._event.is_set():
+                heapq.heappop(self._expiry)
+        return expired
+
+    def close(self):
+        self._lora.remove_listener(self.feed)
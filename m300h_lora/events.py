@@ -0,0 +1,248 @@
+"""
+@author: Abdelrahman Mahmoud Gaber
+@email: abdulrahman.mahmoud1995@gmail.com
+"""
+from commands import *
+
+from collections import deque
+from enum import IntEnum
+import struct
+import tempfile
+import threading
+import time
+
+SPILL_HEADER = struct.Struct("<I") # length prefix of every line in the spill file
+
+
+class OverflowPolicy(IntEnum):
+    DROP_OLDEST = 0 # oldest event is discarded
+    BLOCK = 1 # the reader waits (up to block_timeout) for the subscriber, then drops oldest
+    SPILL = 2 # events are written to a temporary file and read back in order
+
+
+class DownlinkSubscriber:
+
+    def __init__(self, maxlen=64, policy=OverflowPolicy.DROP_OLDEST, block_timeout=0.5, spill_dir=None):
+        """
+        Bounded buffer of downlink events for one consumer.
+
+        :param maxlen: max events kept in memory
+        :param policy: what to do when the buffer is full (OverflowPolicy)
+        :param block_timeout: max seconds the reader waits when policy is BLOCK
+        :param spill_dir: directory for the spill file when policy is SPILL (default temp dir)
+        """
+        if maxlen <= 0:
+            raise ValueError("maxlen must be positive")
+        self._buffer = deque()
+        self._maxlen = maxlen
+        self._policy = OverflowPolicy(policy)
+        self._block_timeout = block_timeout
+        self._spill_dir = spill_dir
+        self._spill = None
+        self._spill_read = 0 # read offset in the spill file
+        self._spill_count = 0 # events waiting in the spill file
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+
+        # counters
+        self.received = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0 # max events buffered (memory + spill) at once
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buffer) + self._spill_count
+
+    def put(self, line, command):
+        """
+        Called by the stream for every event, never blocks longer than block_timeout.
+
+        :param line: raw line as received
+        :param command: parsed Command
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+            self.received += 1
+            if self._spill_count or len(self._buffer) >= self._maxlen:
+                if self._policy == OverflowPolicy.SPILL:
+                    self._spill_line(line)
+                    self._update_high_water()
+                    self._not_empty.notify()
+                    return
+                if self._policy == OverflowPolicy.BLOCK:
+                    deadline = time.monotonic() + self._block_timeout
+                    while len(self._buffer) >= self._maxlen and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._not_full.wait(remaining)
+                if len(self._buffer) >= self._maxlen:
+                    self._buffer.popleft()
+                    self.dropped += 1
+            self._buffer.append(command)
+            self._update_high_water()
+            self._not_empty.notify()
+
+    def _update_high_water(self):
+        size = len(self._buffer) + self._spill_count
+        if size > self.high_water:
+            self.high_water = size
+
+    def _spill_line(self, line):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(dir=self._spill_dir)
+        self._spill.seek(0, 2)
+        self._spill.write(SPILL_HEADER.pack(len(line)) + line)
+        self._spill_count += 1
+        self.spilled += 1
+
+    def _unspill(self):
+        """
+        Move spilled events back to memory while there is room.
+        """
+
+        while self._spill_count and len(self._buffer) < self._maxlen:
+            self._spill.seek(self._spill_read)
+            (size,) = SPILL_HEADER.unpack(self._spill.read(SPILL_HEADER.size))
+            line = self._spill.read(size)
+            self._spill_read += SPILL_HEADER.size + size
+            self._spill_count -= 1
+            self._buffer.append(Command.parse(line))
+        if not self._spill_count and self._spill is not None:
+            self._spill.seek(0)
+            self._spill.truncate()
+            self._spill_read = 0
+
+    def get(self, timeout=None):
+        """
+        Return the next Command, or None on timeout/close.
+        """
+
+        with self._lock:
+            if not self._buffer and self._spill_count:
+                self._unspill()
+            if not self._buffer:
+                self._not_empty.wait_for(lambda: self._buffer or self._spill_count or self._closed, timeout)
+                if not self._buffer and self._spill_count:
+                    self._unspill()
+            if not self._buffer:
+                return None
+            command = self._buffer.popleft()
+            self._not_full.notify()
+            return command
+
+    def __iter__(self):
+        while True:
+            command = self.get()
+            if command is None:
+                return
+            yield command
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+                self._spill_count = 0
+
+    @property
+    def stats(self):
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "high_water": self.high_water,
+            "buffered": len(self),
+        }
+
+
+class DownlinkStream:
+
+    def __init__(self, lora=None, reports=("LRRECV",), interval=0.01):
+        """
+        Fan-out of downlink reports to subscribers.
+
+        :param lora: Lora object, the stream registers itself as listener
+        :param reports: report names (base_name) published to subscribers
+        :param interval: polling interval of the reader thread in seconds
+        """
+        self._lora = lora
+        self._reports = set(reports)
+        self._interval = interval
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        if lora is not None:
+            lora.add_listener(self.feed)
+
+    def subscribe(self, maxlen=64, policy=OverflowPolicy.DROP_OLDEST, block_timeout=0.5, spill_dir=None):
+        subscriber = DownlinkSubscriber(maxlen, policy, block_timeout, spill_dir)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.remove(subscriber)
+        subscriber.close()
+
+    def feed(self, line):
+        """
+        Lora listener, publish line if it is one of the wanted reports.
+        """
+
+        try:
+            command = Command.parse(line)
+        except (CommandError, CommandNotFoundError, IndexError, ValueError):
+            return
+        if command is None or command._mode != REPORT or command.base_name not in self._reports:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(line, command)
+
+    def _run(self):
+        while self._running:
+            try:
+                if self._lora.poll():
+                    continue
+            except Exception as err: # keep reading, the thread would otherwise die silently
+                print("Error reading serial port {}".format(err))
+            time.sleep(self._interval)
+
+    def start(self):
+        """
+        Start a reader thread polling the module input buffer.
+
+        .. NOTE::
+            Lora.poll() takes the same lock as send_raw_command/query, so the reader thread never
+            reads the response of a command sent from another thread.
+        """
+
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscriber in subscribers:
+            subscriber.close()
+        if self._lora is not None and self.feed in self._lora._listeners:
+            self._lora.remove_listener(self.feed)
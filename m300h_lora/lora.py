@@ -20,11 +20,92 @@ class Lora(SerialCommunication):
 
         self._sending_timeout = timeout
         self._status = StatusNetwork.RESET # defualt 
+        self._listeners = [] # callables receiving unsolicited lines (e.g. ^LRRECV)
     
     @property
     def status(self):
         return self._status
 
+    def add_listener(self, listener):
+        """
+        Register a callable that will be called with every unsolicited line read from the module.
+        """
+
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def dispatch(self, lines):
+        """
+        Pass received lines to the registered listeners.
+        """
+
+        for line in lines:
+            for listener in list(self._listeners): # listeners may be added/removed from other threads
+                try:
+                    listener(line)
+                except Exception as err: # a broken listener must not stop the others or the caller
+                    print("Error in listener {}: {}".format(listener, err))
+
+    def poll(self):
+        """
+        Read whatever is waiting in the input buffer and dispatch it to the listeners.
+
+        .. NOTE::
+            Safe to call from a reader thread, it waits for any command in progress to get its
+            response first (see query).
+
+        :returns: number of lines read
+        """
+
+        with self._lock:
+            lines = self._drain()
+        self.dispatch(lines)
+        return len(lines)
+
+    def query_raw(self, data, count=1):
+        """
+        Send data and read the response of each of the count commands in it.
+        Reports received meanwhile are dispatched to the listeners, after the port is released.
+
+        :param data: serialized command(s) as bytes
+        :param count: number of commands in data
+        :returns: list of response lines for every command (empty if the module didn't answer)
+        """
+
+        responses = []
+        with self._lock:
+            reports = self._drain()
+            self.send(data)
+            for _ in range(count):
+                response, received = self._read_response()
+                reports.extend(received)
+                responses.append(response)
+                if not response or not Command.is_final(response[-1]):
+                    break # timed out, the rest won't answer either
+        self.dispatch(reports)
+        return responses + [[] for _ in range(count - len(responses))]
+
+    def query(self, command):
+        """
+        Send command and return its response lines (until OK/ERROR).
+        """
+
+        return self.query_raw(command.serialize().encode())[0]
+
+    def query_many(self, commands):
+        """
+        Send commands in a single write and return the response lines of each one.
+
+        .. NOTE::
+            The module answers commands in order, only use it for commands that don't depend on
+            each other (e.g. SET of different slots).
+        """
+
+        data = b"".join(command.serialize().encode() for command in commands)
+        return self.query_raw(data, len(commands))
+
     def send_raw_command(self, command):
         """
         Send raw command to the LoRa module.
@@ -36,55 +117,60 @@ class Lora(SerialCommunication):
         # clear all coming data if any
         command = command.serialize().encode()
         # timer = time.time()
-        while self.is_available:
-            # for debugging
-            print("----------FOUND IN BUFFER------------")
-            print(self.readlines())
-            print("-------------------------------------")
+        with self._lock:
+            lines = self._drain()
+            if lines and self._debug:
+                print("----------FOUND IN BUFFER------------")
+                print(lines)
+                print("-------------------------------------")
             # if time.time() - timer > self._sending_timeout:
             #     raise Exception("Couldn't clear the buffer")
-        self.send(command)
+            self.send(command)
+        self.dispatch(lines) # don't lose reports (e.g. ^LRRECV) waiting in the buffer
         return 
-lora = Lora("COM12", 9600, timeout=0.1) #/dev/ttyUSB1
-lora.connect()
 
-#%%
-# lora.connect()
-lora.send(b"AT+DIOSLEEP=?\r\n")
-time.sleep(0.1)
-print("coming data: ",  lora.is_available)
-data = lora.readlines()
-print(data)
-#%%
+
+if __name__ == "__main__":
+    lora = Lora("COM12", 9600, timeout=0.1) #/dev/ttyUSB1
+    lora.connect()
+
+    #%%
+    # lora.connect()
+    lora.send(b"AT+DIOSLEEP=?\r\n")
+    time.sleep(0.1)
+    print("coming data: ",  lora.is_available)
+    data = lora.readlines()
+    print(data)
+    #%%
 
 
 
-time.sleep(0.1)
-print("coming data: ",  lora.is_available)
-data = lora.readlines()
-print(data)
+    time.sleep(0.1)
+    print("coming data: ",  lora.is_available)
+    data = lora.readlines()
+    print(data)
 
-name, mode, payload = Command.command_check(data[1]) 
-lrrecv = Command.construct_from_payload(name, mode, payload)
-#print(lrrecv.data[1])
-print(vars(lrrecv))
+    name, mode, payload = Command.command_check(data[1]) 
+    lrrecv = Command.construct_from_payload(name, mode, payload)
+    #print(lrrecv.data[1])
+    print(vars(lrrecv))
 
 
-# lora = Lora("/dev/ttyUSB1", 9600, timeout=0.1)
-# lora.connect()
-# lrsend = Command("LRSEND", SET, port=33, confirm=0, len=33, data="<abcdef")
-# # status = Command("STATUS", GET)
-# # devinfo = Command("DEVINFO", GET)
-# # lora.send_raw_command(devinfo)
-# # lora.send_raw_command(status)
-# lora.send_raw_command(lrsend)
+    # lora = Lora("/dev/ttyUSB1", 9600, timeout=0.1)
+    # lora.connect()
+    # lrsend = Command("LRSEND", SET, port=33, confirm=0, len=33, data="<abcdef")
+    # # status = Command("STATUS", GET)
+    # # devinfo = Command("DEVINFO", GET)
+    # # lora.send_raw_command(devinfo)
+    # # lora.send_raw_command(status)
+    # lora.send_raw_command(lrsend)
 
-# time.sleep(0.1)
-# print("coming data: ",  lora.is_available)
-# data = lora.readlines()
-# print(data)
+    # time.sleep(0.1)
+    # print("coming data: ",  lora.is_available)
+    # data = lora.readlines()
+    # print(data)
 
-# n, m, p = Command.command_check(b'+DEVINFO:"M100C  FW VER:0.99.78  HW VER:1.01(H)  BOOT VER:0.99.14  LORAWAN VER:1.0.2  REGION:AS923"\r\n'.decode().strip())
-# dev_info = Command.construct_from_payload(n, m, p)
-# print(vars(dev_info))
-# dev_info.info
+    # n, m, p = Command.command_check(b'+DEVINFO:"M100C  FW VER:0.99.78  HW VER:1.01(H)  BOOT VER:0.99.14  LORAWAN VER:1.0.2  REGION:AS923"\r\n'.decode().strip())
+    # dev_info = Command.construct_from_payload(n, m, p)
+    # print(vars(dev_info))
+    # dev_info.info
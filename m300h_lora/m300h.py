@@ -27,6 +27,9 @@ CR = "\r"
 LF = "\n"
 CRLF = "\r\n"
 
+OK_STR = "OK" # final line of a successful command
+ERROR_STR = "ERROR" # final line of a failed command, e.g. +ERROR:4
+
 AT_CMD_PREFIX = "AT+"
 
 COMMAND_REGEX = r"(?:\^|\+)([0-9A-Z]+[A-Z]+):" # command regex to check if data contains a command
@@ -360,3 +363,11 @@ class CommandError(Exception):
     """
     pass
 
+class ResponseError(CommandError):
+    """
+    the device answered a command with ERROR or didn't answer at all
+    """
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code # ErrorMsg key, None if unknown or no answer
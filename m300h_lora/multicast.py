@@ -0,0 +1,263 @@
+"""
+@author: Abdelrahman Mahmoud Gaber
+@email: abdulrahman.mahmoud1995@gmail.com
+"""
+from commands import *
+
+MULTICAST_ADDR_MAX = 0xFFFFFFFF
+MULTICAST_KEY_SIZE = 16 # APPSKEY, NWKSKEY are 16 bytes block type
+BLOCK_PREFIX = ">" # block parameters are sent as >HEX
+
+
+class MulticastSlot:
+
+    def __init__(self, index, enabled=False, addr=0, appskey=bytes(MULTICAST_KEY_SIZE),
+                 nwkskey=bytes(MULTICAST_KEY_SIZE), seq=0):
+        """
+        One multicast slot of the module (AT+MULTICASTn).
+
+        :param index: slot number (n in MULTICASTn)
+        :param enabled: whether the multicast address is enabled
+        :param addr: multicast short address as int (0x00 to 0xFFFFFFFF)
+        :param appskey: APPSKEY as 16 bytes
+        :param nwkskey: NWKSKEY as 16 bytes
+        :param seq: multicast frame counter (0 to 0xFFFFFFFF)
+        """
+        if not 0 <= addr <= MULTICAST_ADDR_MAX:
+            raise CommandError("Invalid multicast address {addr}".format(addr=addr))
+        if not 0 <= seq <= MULTICAST_ADDR_MAX:
+            raise CommandError("Invalid multicast seq {seq}".format(seq=seq))
+        for key in (appskey, nwkskey):
+            if len(key) != MULTICAST_KEY_SIZE:
+                raise CommandError("Multicast keys must be {size} bytes".format(size=MULTICAST_KEY_SIZE))
+
+        self.index = index
+        self.enabled = bool(enabled)
+        self.addr = addr
+        self.appskey = bytes(appskey)
+        self.nwkskey = bytes(nwkskey)
+        self.seq = seq
+
+    @staticmethod
+    def from_command(command):
+        """
+        Build a slot from a parsed MULTICASTn command (e.g. the output of Command.parse).
+
+        :param command: Command with base_name MULTICAST
+        """
+
+        return MulticastSlot(
+            int(command.name[len(command.base_name):]),
+            enabled=int(command.s),
+            addr=int(command.addr, 16),
+            appskey=bytes.fromhex(command.appskey.lstrip(BLOCK_PREFIX)),
+            nwkskey=bytes.fromhex(command.nwkskey.lstrip(BLOCK_PREFIX)),
+            seq=int(command.seq, 0),
+        )
+
+    def to_command(self):
+        """
+        Build the AT+MULTICASTn SET command for this slot.
+        """
+
+        return Command(
+            "MULTICAST{index}".format(index=self.index), SET,
+            s=int(self.enabled),
+            addr="0x{addr:08X}".format(addr=self.addr),
+            appskey=BLOCK_PREFIX + self.appskey.hex().upper(),
+            nwkskey=BLOCK_PREFIX + self.nwkskey.hex().upper(),
+            seq=self.seq,
+        )
+
+    def _key(self):
+        return (self.index, self.enabled, self.addr, self.appskey, self.nwkskey, self.seq)
+
+    def __eq__(self, other):
+        if not isinstance(other, MulticastSlot):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def copy(self):
+        return MulticastSlot(self.index, self.enabled, self.addr, self.appskey, self.nwkskey, self.seq)
+
+    def __str__(self):
+        # keys are left out on purpose, they shouldn't end up in logs
+        return "MulticastSlot(index={index}, enabled={enabled}, addr=0x{addr:08X}, seq={seq})".format(
+            index=self.index, enabled=self.enabled, addr=self.addr, seq=self.seq
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class MulticastManager:
+
+    def __init__(self, lora):
+        """
+        Keeps a local copy of the module multicast slots so that many groups can be provisioned
+        with one MULTICASTALL query and only the changed slots written back.
+
+        :param lora: connected Lora object, the manager registers itself as listener
+        """
+        self._lora = lora
+        self._device = {} # index -> MulticastSlot as last read from/written to the module
+        self._slots = {} # index -> MulticastSlot as wanted by the user
+        self._ports = {} # downlink port -> index, used to track seq from LRRECV
+        lora.add_listener(self.feed)
+
+    @property
+    def slots(self):
+        return [self._slots[index] for index in sorted(self._slots)]
+
+    @staticmethod
+    def _parse(lines):
+        """
+        Parse response lines, unknown lines are skipped.
+        """
+
+        commands = []
+        for line in lines:
+            try:
+                parsed = Command.parse(line)
+            except (CommandError, CommandNotFoundError, IndexError, ValueError):
+                continue
+            if parsed is not None:
+                commands.append(parsed)
+        return commands
+
+    def refresh(self):
+        """
+        Read all slots from the module with a single AT+MULTICASTALL=? query.
+        """
+
+        lines = Command.check_response(self._lora.query(Command("MULTICASTALL", GET)))
+        self._device.clear()
+        for command in self._parse(lines):
+            if command.base_name == "MULTICAST":
+                slot = MulticastSlot.from_command(command)
+                self._device[slot.index] = slot
+        self._slots = {index: slot.copy() for index, slot in self._device.items()}
+        return self.slots
+
+    def __getitem__(self, index):
+        return self._slots[index]
+
+    def find(self, addr):
+        """
+        Return the enabled slot using addr or None.
+        """
+
+        for slot in self._slots.values():
+            if slot.enabled and slot.addr == addr:
+                return slot
+        return None
+
+    def allocate(self, addr, appskey, nwkskey, seq=0):
+        """
+        Put a multicast group into a free (disabled) slot, or update the slot already using addr.
+        Nothing is written to the module until commit() is called.
+
+        :returns: the allocated MulticastSlot
+        """
+
+        slot = self.find(addr)
+        if slot is None:
+            free = [index for index in sorted(self._slots) if not self._slots[index].enabled]
+            if not free:
+                raise CommandError("No free multicast slot for address 0x{addr:08X}".format(addr=addr))
+            slot = self._slots[free[0]]
+        new_slot = MulticastSlot(slot.index, True, addr, appskey, nwkskey, seq)
+        self._slots[slot.index] = new_slot
+        return new_slot
+
+    def release(self, addr):
+        """
+        Disable the slot used by addr (keys are cleared), written on next commit().
+        """
+
+        slot = self.find(addr)
+        if slot is None:
+            return None
+        self._slots[slot.index] = MulticastSlot(slot.index)
+        for port, index in list(self._ports.items()):
+            if index == slot.index:
+                del self._ports[port]
+        return self._slots[slot.index]
+
+    @property
+    def pending(self):
+        """
+        Slots that differ from what the module has.
+        """
+
+        return [slot for slot in self.slots if self._device.get(slot.index) != slot]
+
+    def commit(self):
+        """
+        Write only the changed slots to the module, all of them in a single write.
+        Slots the module rejected stay pending and a ResponseError is raised after the others are recorded.
+
+        :returns: list of written slots
+        """
+
+        pending = self.pending
+        if not pending:
+            return []
+        responses = self._lora.query_many([slot.to_command() for slot in pending])
+        written, failed = [], []
+        for slot, response in zip(pending, responses):
+            try:
+                Command.check_response(response, "MULTICAST{index}".format(index=slot.index))
+            except ResponseError as err:
+                failed.append((slot, err))
+                continue
+            self._device[slot.index] = slot.copy()
+            written.append(slot)
+            if self._lora._debug:
+                print("INFO: Multicast slot written {slot}".format(slot=slot))
+        if failed:
+            raise ResponseError("Multicast slots not written: {errors}".format(
+                errors=", ".join("{index} ({err})".format(index=slot.index, err=err) for slot, err in failed)
+            ), failed[0][1].code)
+        return written
+
+    def bind_port(self, addr, port):
+        """
+        Downlinks of the group addr are received on port, LRRECV on this port updates the slot seq.
+        """
+
+        slot = self.find(addr)
+        if slot is None:
+            raise CommandError("Multicast address 0x{addr:08X} not allocated".format(addr=addr))
+        self._ports[port] = slot.index
+
+    def feed(self, line):
+        """
+        Lora listener, pass received lines to observe.
+        """
+
+        for command in self._parse([line]):
+            self.observe(command)
+
+    def observe(self, command):
+        """
+        Track seq from received commands, MULTICASTn responses replace the cached slot
+        and ^LRRECV on a bound port moves the slot seq forward.
+
+        :param command: parsed Command
+        """
+
+        if command.base_name == "MULTICAST":
+            slot = MulticastSlot.from_command(command)
+            pending = self._slots.get(slot.index) != self._device.get(slot.index)
+            self._device[slot.index] = slot
+            if not pending: # keep allocate()/release() changes that aren't committed yet
+                self._slots[slot.index] = slot.copy()
+        elif command.base_name == "LRRECV" and command.port in self._ports:
+            index = self._ports[command.port]
+            for slots in (self._device, self._slots):
+                if index in slots and command.seq > slots[index].seq:
+                    slots[index].seq = command.seq
+
+    def close(self):
+        self._lora.remove_listener(self.feed)
@@ -1,20 +1,57 @@
 from serial import Serial, SerialException, SerialTimeoutException
+from tracelog import TraceRecorder, INBOUND, OUTBOUND
+from commands import Command
+import threading
 import time
 
+# baud rates tried by negotiate_baudrate(), fastest first
+BAUDRATES = (115200, 57600, 38400, 19200, 9600)
+
+PROBE_COMMAND = b"AT+STATUS=?\r\n" # cheap command every firmware answers
+
+
 class SerialCommunication:
 
-    def __init__(self, port, baudrate, timeout=1, debug=True):
+    def __init__(self, port, baudrate, timeout=1, debug=True, write_timeout=None):
         self._serial_object = None
         self._connected = False
         self._reading = False
         self._port = port
         self._baudrate = baudrate
         self._timeout = timeout
+        self._write_timeout = write_timeout
         self._debug = debug
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        self._start_time = None
+        self._trace = None # TraceRecorder, see start_trace()
+        # held for a command and its response (or a poll) so threads sharing the port don't read each other's data
+        self._lock = threading.RLock()
 
     def __del__(self):
 
         self.disconnect()
+        self.stop_trace()
+
+    def start_trace(self, path, **kwargs):
+        """
+        Record every inbound and outbound line to a binary trace file (see tracelog.TraceReader).
+
+        :param path: trace file path
+        :param kwargs: passed to TraceRecorder (index_interval, buffering)
+        """
+
+        self.stop_trace()
+        self._trace = TraceRecorder(path, **kwargs)
+
+    def stop_trace(self):
+        """
+        Stop recording and write the trace index.
+        """
+
+        trace, self._trace = getattr(self, "_trace", None), None
+        if trace is not None:
+            trace.close()
 
     def connect(self):
         """
@@ -24,10 +61,12 @@ class SerialCommunication:
         self._connected = False
         try:
             self._serial_object = Serial(
-                self._port, self._baudrate, timeout=self._timeout
+                self._port, self._baudrate, timeout=self._timeout,
+                write_timeout=self._write_timeout
             )
 
             self._connected = True
+            self.reset_stats()
             if self._debug:
                 print("INFO: Connected Successfully to port: {}".format(self._port))
             
@@ -55,7 +94,51 @@ class SerialCommunication:
         Send data to serial connection.
         """
 
-        self._serial_object.write(data)
+        self._bytes_sent += self._serial_object.write(data) or 0
+        if self._trace is not None:
+            for line in data.splitlines(keepends=True): # coalesced frames are traced one by one
+                self._trace.record(OUTBOUND, line)
+
+    def dispatch(self, lines):
+        """
+        Called with unsolicited lines (reports) read while draining or waiting for a response,
+        overridden by Lora to pass them to its listeners.
+        """
+
+        pass
+
+    def _drain(self):
+        """
+        Read the lines already waiting in the input buffer, hold self._lock when calling it.
+        """
+
+        lines = []
+        while self.is_available:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+        return lines
+
+    def _read_response(self):
+        """
+        Read lines until OK/ERROR or timeout, hold self._lock when calling it.
+
+        :returns: (response lines, report lines)
+        """
+
+        response, reports = [], []
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            if line.startswith(b"^"):
+                reports.append(line)
+                continue
+            response.append(line)
+            if Command.is_final(line):
+                break
+        return response, reports
 
     def flush(self):
         """
@@ -69,22 +152,38 @@ class SerialCommunication:
         Read bytes(size) from serial connection.
         """
 
-        return self._serial_object.read(size)
+        data = self._serial_object.read(size)
+        self._bytes_received += len(data)
+        if self._trace is not None and data:
+            self._trace.record(INBOUND, data)
+        return data
 
     def readline(self):
         """
         Read line from serial connection.
         """
 
-        return self._serial_object.readline()
+        line = self._serial_object.readline()
+        self._bytes_received += len(line)
+        if self._trace is not None and line:
+            self._trace.record(INBOUND, line)
+        return line
     
     def readlines(self):
         """
         Read a list of recived lines from serial connection.
         """
         
-        # return [line.decode() for line in self._serial_object.readlines()]
-        return self._serial_object.readlines()
+        # one readline() per line (same as Serial.readlines) so every line is counted and traced when read
+        lines = []
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            if not line.endswith(b"\n"): # timed out in the middle of a line
+                break
+        return lines
 
     @property
     def is_available(self):
@@ -94,6 +193,84 @@ class SerialCommunication:
 
         return self._serial_object.in_waiting
 
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        """
+        Change the host side baud rate, the port is reconfigured without closing it.
+        """
+
+        self._baudrate = baudrate
+        if self._connected and self._serial_object:
+            self._serial_object.baudrate = baudrate
+
+    def probe(self, retries=2):
+        """
+        Check if the module answers at the current baud rate.
+        Lines waiting in the input buffer are passed to dispatch(), not thrown away.
+        """
+
+        reports, answered = [], False
+        with self._lock:
+            for _ in range(retries):
+                reports.extend(self._drain())
+                self.send(PROBE_COMMAND)
+                response, received = self._read_response()
+                reports.extend(received)
+                if any(line.startswith(b"+STATUS:") for line in response):
+                    answered = True
+                    break
+        self.dispatch(reports)
+        return answered
+
+    def negotiate_baudrate(self, baudrates=BAUDRATES, retries=2):
+        """
+        Find the highest baud rate the module answers on reliably and switch to it.
+
+        :param baudrates: baud rates to try, fastest first
+        :param retries: probes per baud rate, all of them must succeed for the rate to be stable
+        :returns: selected baud rate or None if the module didn't answer on any of them
+            (the original baud rate is restored)
+        """
+
+        # held across the switch and the probes, no other thread may talk to the module at a rate being tried
+        with self._lock:
+            original = self._baudrate
+            for baudrate in baudrates:
+                self.baudrate = baudrate
+                if all(self.probe(retries=1) for _ in range(retries)):
+                    if self._debug:
+                        print("INFO: Using baud rate {}".format(baudrate))
+                    self.reset_stats()
+                    return baudrate
+            self.baudrate = original
+        return None
+
+    def reset_stats(self):
+        """
+        Reset bytes counters used by throughput.
+        """
+
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        self._start_time = time.monotonic()
+
+    @property
+    def throughput(self):
+        """
+        Measured effective (bytes sent/sec, bytes received/sec) since connect or reset_stats().
+        """
+
+        if self._start_time is None:
+            return 0.0, 0.0
+        elapsed = time.monotonic() - self._start_time
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return self._bytes_sent / elapsed, self._bytes_received / elapsed
+
 
 # lora = SerialCommunication("/dev/ttyUSB0", 9600, timeout=1)
 # lora.connect()
@@ -0,0 +1,282 @@
+"""
+@author: Abdelrahman Mahmoud Gaber
+@email: abdulrahman.mahmoud1995@gmail.com
+"""
+from commands import *
+
+from bisect import bisect_right
+import mmap
+import os
+import struct
+import threading
+import time
+
+"""
+Trace file layout (little endian):
+
+    header : magic "M3TR", version u16, flags u16, wall clock ns u64, monotonic ns u64,
+             offset of the last index block u64 (0: none yet), index_interval u32
+    record : length u32, monotonic ns u64, direction u8, payload (repeated)
+
+Every index_interval records the recorder flushes the file and keeps an index entry (monotonic ns u64,
+file offset u64). Every index_block entries they are written as a TRACE_INDEX record whose payload is the
+offset of the previous index block u64 followed by the entries, and the header is updated to point at it.
+A live or crashed trace is readable: the reader follows the index blocks from the header and only scans
+the records written after the last one.
+"""
+
+TRACE_MAGIC = b"M3TR"
+TRACE_VERSION = 2
+
+TRACE_HEADER = struct.Struct("<4sHHQQQI")
+TRACE_LAST_INDEX = struct.Struct("<Q")
+TRACE_LAST_INDEX_POS = 24 # offset of the last index block field in the header
+TRACE_RECORD = struct.Struct("<IQB")
+TRACE_INDEX_ENTRY = struct.Struct("<QQ")
+
+# record direction
+INBOUND = 0 # module -> host
+OUTBOUND = 1 # host -> module
+TRACE_INDEX = 2 # index block, skipped when reading records
+
+DIRECTION_STR = {
+    INBOUND: "IN",
+    OUTBOUND: "OUT"
+}
+
+
+class TraceRecorder:
+
+    def __init__(self, path, index_interval=256, index_block=16, buffering=1 << 16):
+        """
+        Write every serial line with its monotonic timestamp and direction to a binary trace file.
+
+        :param path: trace file path (overwritten)
+        :param index_interval: records between two index entries, the file is flushed at each entry
+        :param index_block: index entries written together in one index block
+        :param buffering: file buffer size
+        """
+        self._file = open(path, "wb", buffering=buffering)
+        self._index_interval = index_interval
+        self._index_block = index_block
+        self._entries = [] # (timestamp, offset) not written yet
+        self._last_index = 0
+        self._count = 0
+        self._offset = TRACE_HEADER.size
+        self._lock = threading.Lock()
+        self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0, time.time_ns(), time.monotonic_ns(),
+                                           0, index_interval))
+        self._file.flush() # readable right away
+
+    def record(self, direction, data):
+        """
+        Append one line.
+
+        :param direction: INBOUND or OUTBOUND
+        :param data: line bytes
+        """
+
+        with self._lock:
+            if self._file is None:
+                return
+            timestamp = time.monotonic_ns() # taken under the lock so records are in time order
+            if self._count % self._index_interval == 0:
+                if len(self._entries) >= self._index_block:
+                    self._write_index()
+                self._file.flush() # at most index_interval records are lost on a crash
+                self._entries.append((timestamp, self._offset))
+            self._file.write(TRACE_RECORD.pack(len(data), timestamp, direction))
+            self._file.write(data)
+            self._offset += TRACE_RECORD.size + len(data)
+            self._count += 1
+
+    def _write_index(self):
+        """
+        Write the pending index entries as an index block and point the header at it, hold self._lock.
+        """
+
+        payload = TRACE_LAST_INDEX.pack(self._last_index) + b"".join(
+            TRACE_INDEX_ENTRY.pack(*entry) for entry in self._entries)
+        offset = self._offset
+        self._file.write(TRACE_RECORD.pack(len(payload), self._entries[-1][0], TRACE_INDEX))
+        self._file.write(payload)
+        self._offset += TRACE_RECORD.size + len(payload)
+        self._file.flush() # the block is on disk before the header points to it
+        self._file.seek(TRACE_LAST_INDEX_POS)
+        self._file.write(TRACE_LAST_INDEX.pack(offset))
+        self._file.seek(self._offset)
+        self._last_index = offset
+        self._entries = []
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """
+        Write the remaining index entries and close the file.
+        """
+
+        with self._lock:
+            if self._file is None:
+                return
+            if self._entries:
+                self._write_index()
+            self._file.close()
+            self._file = None
+
+
+class TraceRecord:
+
+    __slots__ = ("timestamp", "direction", "_buffer", "_start", "_end", "_command")
+
+    def __init__(self, timestamp, direction, buffer, start, end):
+        """
+        One trace line, the data is only copied and parsed when accessed.
+        """
+        self.timestamp = timestamp
+        self.direction = direction
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+        self._command = False # not parsed yet
+
+    @property
+    def data(self):
+        return self._buffer[self._start:self._end]
+
+    @property
+    def command(self):
+        """
+        Line parsed with Command.parse, None if it isn't an AT command (e.g. OK, ERROR).
+        """
+
+        if self._command is False:
+            try:
+                self._command = Command.parse(self.data)
+            except (CommandError, CommandNotFoundError, IndexError, ValueError):
+                self._command = None
+        return self._command
+
+    def __str__(self):
+        return "TraceRecord(timestamp={timestamp}, direction={direction}, data={data})".format(
+            timestamp=self.timestamp, direction=DIRECTION_STR[self.direction], data=self.data
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class TraceReader:
+
+    def __init__(self, path):
+        """
+        Memory mapped reader of a trace file written by TraceRecorder, it can be opened while the
+        recorder is still writing (records written after opening aren't seen).
+
+        :param path: trace file path
+        """
+        self._file = open(path, "rb")
+        self._mmap = None
+        self._index = [] # (timestamp, offset)
+        self._end = 0
+        self.wall_start = self.monotonic_start = None
+        size = os.fstat(self._file.fileno()).st_size
+        if size < TRACE_HEADER.size: # just created, nothing to read yet
+            return
+        self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        (magic, version, _, self.wall_start, self.monotonic_start,
+         last_index, self._index_interval) = TRACE_HEADER.unpack_from(self._mmap, 0)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError("Not a trace file (magic {magic}, version {version})".format(
+                magic=magic, version=version))
+        self._read_index(last_index)
+        self._timestamps = [entry[0] for entry in self._index]
+
+    def _record_at(self, offset):
+        """
+        Return (length, timestamp, direction) of the record at offset or None if it's incomplete.
+        """
+
+        if offset + TRACE_RECORD.size > len(self._mmap):
+            return None
+        header = TRACE_RECORD.unpack_from(self._mmap, offset)
+        if offset + TRACE_RECORD.size + header[0] > len(self._mmap):
+            return None
+        return header
+
+    def _read_index(self, last_index):
+        # index blocks, newest first
+        blocks = []
+        offset = last_index
+        while offset:
+            length, _, direction = self._record_at(offset)
+            start = offset + TRACE_RECORD.size
+            (offset,) = TRACE_LAST_INDEX.unpack_from(self._mmap, start)
+            count = (length - TRACE_LAST_INDEX.size) // TRACE_INDEX_ENTRY.size
+            blocks.append([TRACE_INDEX_ENTRY.unpack_from(self._mmap, start + TRACE_LAST_INDEX.size +
+                                                         i * TRACE_INDEX_ENTRY.size) for i in range(count)])
+        for block in reversed(blocks):
+            self._index.extend(block)
+
+        # records after the last index block, sparse entries every index_interval records
+        offset = TRACE_HEADER.size
+        if last_index:
+            offset = last_index + TRACE_RECORD.size + self._record_at(last_index)[0]
+        count = 0
+        while True:
+            header = self._record_at(offset)
+            if header is None: # end of file or record still being written
+                break
+            length, timestamp, direction = header
+            if direction != TRACE_INDEX:
+                if count % self._index_interval == 0:
+                    self._index.append((timestamp, offset))
+                count += 1
+            offset += TRACE_RECORD.size + length
+        self._end = offset
+
+    def to_wall_time(self, timestamp):
+        """
+        Convert a record monotonic timestamp (ns) to wall clock time (seconds since epoch).
+        """
+
+        return (self.wall_start + timestamp - self.monotonic_start) / 1e9
+
+    def records(self, start=None, end=None):
+        """
+        Iterate records with start <= timestamp < end (monotonic ns), only the index is used to
+        find the first one.
+        """
+
+        offset = TRACE_HEADER.size
+        if start is not None and self._index:
+            position = bisect_right(self._timestamps, start) - 1
+            if position >= 0:
+                offset = self._index[position][1]
+        while offset < self._end:
+            length, timestamp, direction = TRACE_RECORD.unpack_from(self._mmap, offset)
+            data_start = offset + TRACE_RECORD.size
+            offset = data_start + length
+            if direction == TRACE_INDEX:
+                continue
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp >= end:
+                return
+            yield TraceRecord(timestamp, direction, self._mmap, data_start, offset)
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
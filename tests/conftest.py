@@ -0,0 +1,66 @@
+import os
+import sys
+from collections import deque
+
+import pytest
+
+# modules of the package import each other by name (e.g. "from commands import *")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "m300h_lora"))
+
+
+class FakeSerial:
+    """
+    Minimal stand-in for serial.Serial, every written command gets the lines in answers[command].
+    """
+
+    def __init__(self, answers=None):
+        self.answers = answers or {}
+        self.input = deque()
+        self.written = []
+        self.baudrate = 9600
+
+    def write(self, data):
+        self.written.append(data)
+        for line in data.splitlines(keepends=True):
+            self.input.extend(self.answers.get(line, []))
+        return len(data)
+
+    def readline(self):
+        return self.input.popleft() if self.input else b""
+
+    def readlines(self):
+        lines = list(self.input)
+        self.input.clear()
+        return lines
+
+    def read(self, size=1):
+        return self.readline()[:size]
+
+    @property
+    def in_waiting(self):
+        return sum(len(line) for line in self.input)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.input.clear()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_serial():
+    return FakeSerial()
+
+
+@pytest.fixture
+def lora(fake_serial):
+    pytest.importorskip("serial")
+    from lora import Lora
+
+    lora = Lora("fake", 9600, debug=False)
+    lora._serial_object = fake_serial
+    lora._connected = True
+    return lora
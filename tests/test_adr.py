@@ -0,0 +1,75 @@
+import pytest
+
+from adr import RateController
+from m300h import CurrentADR, CurrentPower, ResponseError
+
+
+class FakeLora:
+    _debug = True
+
+    def __init__(self):
+        self.sent = []
+        self.answer = [b"OK\r\n"]
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def query(self, command):
+        self.sent.append(command.serialize())
+        return self.answer
+
+
+def confirms(controller, snr, dr=0, count=4):
+    for seq in range(count):
+        controller.feed(b"^LRCONFIRM:%d,-90,%d,923.2,%d\r\n" % (seq, snr, dr))
+
+
+def test_listener_only_records_decision():
+    lora = FakeLora()
+    controller = RateController(lora, window=4)
+    confirms(controller, snr=2)
+    assert lora.sent == []
+    assert controller.recommendation == (CurrentADR.DR_4, CurrentPower.DBm_16)
+    assert controller.apply() == (CurrentADR.DR_4, CurrentPower.DBm_16)
+    assert lora.sent == ["AT+CURRENTDR=4\r\n"]
+    assert controller.dr == CurrentADR.DR_4
+    assert controller.apply() is None
+
+
+def test_rejected_setting_is_kept_as_recommendation():
+    lora = FakeLora()
+    lora.answer = [b"+ERROR:5\r\n"]
+    controller = RateController(lora, window=4)
+    confirms(controller, snr=2)
+    with pytest.raises(ResponseError):
+        controller.apply()
+    assert controller.dr == CurrentADR.DR_0
+    assert controller.recommendation[0] == CurrentADR.DR_4
+
+
+def test_adr_enabled_follows_uplink_dr(capsys):
+    lora = FakeLora()
+    controller = RateController(lora, adr_enabled=True, window=4)
+    controller.feed(b"^LRSEND:1,1,1,1,923.2,3\r\n")
+    assert controller.dr == CurrentADR.DR_3
+    confirms(controller, snr=2, dr=5) # downlink DR must not be taken as the uplink one
+    confirms(controller, snr=2, dr=5)
+    assert controller.dr == CurrentADR.DR_3
+    assert controller.apply() is None
+    assert lora.sent == []
+    assert capsys.readouterr().out.count("link feedback suggests") == 1
+
+
+def test_dr_steps_follow_uneven_floors():
+    lora = FakeLora()
+    controller = RateController(lora, window=4, dr=CurrentADR.DR_5, max_dr=CurrentADR.DR_7)
+    confirms(controller, snr=8, dr=5) # 5.5dB above the DR_5 floor and margin, DR_7 needs 12.5dB more
+    assert controller.recommendation == (CurrentADR.DR_6, CurrentPower.DBm_16)
+    controller.apply()
+    confirms(controller, snr=8, dr=6)
+    assert controller.recommendation == (CurrentADR.DR_6, CurrentPower.DBm_16)
+
+    controller = RateController(lora, window=4, dr=CurrentADR.DR_7, max_dr=CurrentADR.DR_7)
+    confirms(controller, snr=10, dr=7) # 5dB short at DR_7, DR_6 is 9.5dB more robust
+    assert controller.recommendation == (CurrentADR.DR_6, CurrentPower.DBm_16)
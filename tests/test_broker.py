@@ -0,0 +1,111 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import broker
+import commands
+from broker import LoraBroker, LoraClient
+from commands import Command, GET
+from m300h import ResponseError
+
+LRRECV = b"^LRRECV:1,22,-44,29,2,<ABCD,923.2,2\r\n"
+
+
+class FakeLora:
+    _debug = False
+
+    def __init__(self):
+        self._listeners = []
+        self.reports = []
+        self.lock = threading.Lock()
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def dispatch(self, lines):
+        for line in lines:
+            for listener in list(self._listeners):
+                listener(line)
+
+    def poll(self):
+        with self.lock:
+            lines, self.reports = self.reports, []
+        self.dispatch(lines)
+        return len(lines)
+
+    def query_raw(self, data, count=1):
+        if data.startswith(b"AT+DEVINFO"):
+            time.sleep(0.3) # slower than the client timeout
+            return [[b'+DEVINFO:"M300H"\r\n', b"OK\r\n"]]
+        return [[b"+STATUS:3\r\n", b"OK\r\n"]]
+
+
+@pytest.fixture
+def lora_broker(tmp_path):
+    lora_broker = LoraBroker(FakeLora(), str(tmp_path / "lora.sock"))
+    lora_broker.start()
+    yield lora_broker
+    lora_broker.stop()
+
+
+@pytest.fixture
+def client(lora_broker):
+    client = LoraClient(lora_broker._path, timeout=0.1, debug=False)
+    assert client.connect()
+    yield client
+    client.disconnect()
+
+
+def test_frame_types_dont_shadow_command_modes():
+    assert broker.REPORT == commands.REPORT
+    assert broker.FRAME_REPORT != commands.REPORT
+
+
+def test_late_response_is_not_taken_by_next_request(client):
+    with pytest.raises(ResponseError):
+        client.query(Command("DEVINFO", GET))
+    client._timeout = 1
+    assert client.query(Command("STATUS", GET)) == [b"+STATUS:3\r\n", b"OK\r\n"]
+    assert client.query(Command("STATUS", GET)) == [b"+STATUS:3\r\n", b"OK\r\n"]
+
+
+def test_listener_can_send_commands(lora_broker, client):
+    responses, done = [], threading.Event()
+
+    def failing(line):
+        raise ValueError("broken listener")
+
+    def sending(line):
+        responses.append(client.query(Command("STATUS", GET)))
+        done.set()
+
+    client.add_listener(failing)
+    client.add_listener(sending)
+    time.sleep(0.05) # let the broker see the subscription
+    with lora_broker._lora.lock:
+        lora_broker._lora.reports.append(LRRECV)
+    assert done.wait(1)
+    assert responses == [[b"+STATUS:3\r\n", b"OK\r\n"]]
+    assert client._connected and client._reader.is_alive()
+
+
+def test_query_after_reconnect(client):
+    client.disconnect()
+    client._reader.join(1)
+    assert client.connect()
+    assert client.query(Command("STATUS", GET)) == [b"+STATUS:3\r\n", b"OK\r\n"]
+
+
+def test_bad_subscribe_only_affects_its_client(lora_broker, client):
+    bad = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    bad.connect(lora_broker._path)
+    bad.sendall(broker._frame(broker.FRAME_SUBSCRIBE, b"\xff\xfe,LRRECV"))
+    time.sleep(0.05)
+    assert lora_broker._threads[0].is_alive()
+    assert client.query(Command("STATUS", GET)) == [b"+STATUS:3\r\n", b"OK\r\n"]
+    bad.close()
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from commands import Command, SET
+from confirm import ConfirmTracker
+from m300h import ResponseError
+
+
+class FakeLora:
+
+    def __init__(self):
+        self.answers = []
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def query(self, command):
+        response, reports = self.answers.pop(0)
+        for line in reports:
+            for listener in self._listeners:
+                listener(line)
+        return response
+
+    def report(self, line):
+        for listener in self._listeners:
+            listener(line)
+
+
+def lrsend():
+    return Command("LRSEND", SET, port=1, confirm=1, len=1, data="<AB")
+
+
+def test_confirm_resolves_by_seq():
+    lora = FakeLora()
+    tracker = ConfirmTracker(lora, trial_timeout=5)
+    lora.answers = [([b"OK\r\n"], [b"^LRSEND:7,1,1,1,923.2,2\r\n"]), ([b"OK\r\n"], [])]
+    first, second = tracker.send(lrsend()), tracker.send(lrsend())
+    lora.report(b"^LRSEND:8,1,1,1,923.2,2\r\n")
+    lora.report(b"^LRCONFIRM:8,-100,5,923.2,2\r\n")
+    assert (first.seq, second.seq) == (7, 8)
+    assert second.done and second.latency is not None
+    assert not first.done
+    assert len(tracker) == 1
+
+
+def test_rejected_send_does_not_shift_seq():
+    lora = FakeLora()
+    tracker = ConfirmTracker(lora, trial_timeout=5)
+    lora.answers = [([b"+ERROR:7\r\n"], []), ([b"OK\r\n"], [])]
+    with pytest.raises(ResponseError) as err:
+        tracker.send(lrsend())
+    assert err.value.code == 7
+    handle = tracker.send(lrsend())
+    lora.report(b"^LRSEND:3,1,1,1,923.2,2\r\n")
+    assert handle.seq == 3
+
+
+def test_done_expires_without_traffic():
+    lora = FakeLora()
+    tracker = ConfirmTracker(lora, trial_timeout=0.01)
+    lora.answers = [([b"OK\r\n"], [])]
+    handle = tracker.send(lrsend())
+    time.sleep(0.02)
+    assert handle.done and handle.timed_out
+    assert len(tracker) == 0
+
+
+def test_report_of_expired_uplink_is_dropped():
+    lora = FakeLora()
+    tracker = ConfirmTracker(lora, trial_timeout=0.05)
+    lora.answers = [([b"OK\r\n"], []), ([b"OK\r\n"], [])]
+    first = tracker.send(lrsend())
+    time.sleep(0.06)
+    second = tracker.send(lrsend())
+    assert first.timed_out
+    lora.report(b"^LRSEND:7,1,1,1,923.2,2\r\n")
+    lora.report(b"^LRCONFIRM:7,-100,5,923.2,2\r\n")
+    assert second.seq is None and not second.done
+    assert first.confirm is None
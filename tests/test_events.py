@@ -0,0 +1,81 @@
+import threading
+import time
+
+from events import DownlinkStream, DownlinkSubscriber, OverflowPolicy
+
+LRRECV = b"^LRRECV:%d,10,-44,29,2,<ABCD,923.2,2\r\n"
+
+
+def publish(stream, count):
+    for seq in range(count):
+        stream.feed(LRRECV % seq)
+
+
+def seqs(subscriber):
+    result = []
+    while True:
+        command = subscriber.get(timeout=0)
+        if command is None:
+            return result
+        result.append(command.seq)
+
+
+def test_drop_oldest():
+    stream = DownlinkStream()
+    subscriber = stream.subscribe(maxlen=2)
+    publish(stream, 5)
+    assert seqs(subscriber) == [3, 4]
+    assert subscriber.stats == {"received": 5, "dropped": 3, "spilled": 0, "high_water": 2, "buffered": 0}
+
+
+def test_spill_keeps_order():
+    stream = DownlinkStream()
+    subscriber = stream.subscribe(maxlen=2, policy=OverflowPolicy.SPILL)
+    publish(stream, 5)
+    assert subscriber.spilled == 3
+    assert subscriber.high_water == 5
+    assert seqs(subscriber) == [0, 1, 2, 3, 4]
+    publish(stream, 1) # spill file was emptied, new events go to memory again
+    assert seqs(subscriber) == [0]
+    assert subscriber.spilled == 3
+
+
+def test_block_times_out_and_drops():
+    subscriber = DownlinkSubscriber(maxlen=1, policy=OverflowPolicy.BLOCK, block_timeout=0.01)
+    stream = DownlinkStream()
+    stream._subscribers.append(subscriber)
+    start = time.monotonic()
+    publish(stream, 3)
+    assert time.monotonic() - start < 1
+    assert seqs(subscriber) == [2]
+    assert subscriber.dropped == 2
+
+
+def test_block_waits_for_consumer():
+    stream = DownlinkStream()
+    subscriber = stream.subscribe(maxlen=1, policy=OverflowPolicy.BLOCK, block_timeout=5)
+    received = []
+    consumer = threading.Thread(target=lambda: received.extend(subscriber.get(timeout=5).seq for _ in range(3)))
+    consumer.start()
+    publish(stream, 3)
+    consumer.join()
+    assert received == [0, 1, 2]
+    assert subscriber.dropped == 0
+
+
+def test_subscribers_are_independent():
+    stream = DownlinkStream()
+    slow = stream.subscribe(maxlen=1)
+    fast = stream.subscribe(maxlen=8)
+    publish(stream, 3)
+    assert seqs(fast) == [0, 1, 2]
+    assert slow.dropped == 2 and fast.dropped == 0
+
+
+def test_only_reports_are_published():
+    stream = DownlinkStream()
+    subscriber = stream.subscribe()
+    stream.feed(b"+STATUS:3\r\n")
+    stream.feed(b"^LRCONFIRM:1,-128,10,481.5,0\r\n")
+    stream.feed(b"OK\r\n")
+    assert subscriber.get(timeout=0) is None
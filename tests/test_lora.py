@@ -0,0 +1,68 @@
+import threading
+import time
+
+from commands import Command, GET
+from events import DownlinkStream
+
+MULTICASTALL = b"AT+MULTICASTALL=?\r\n"
+MULTICAST0 = b"+MULTICAST0:1,0x0000ABCD,>FFEEDDCC8C7FC6CBC33D0809FB565001,>FFEEDDCC8C7FC6CBC33D0809FB565002,5\r\n"
+LRRECV = b"^LRRECV:1,22,-44,29,2,<ABCD,923.2,2\r\n"
+
+
+def test_query_returns_response_and_dispatches_reports(lora, fake_serial):
+    fake_serial.answers[MULTICASTALL] = [MULTICAST0, LRRECV, b"OK\r\n", b"+STATUS:3\r\n"]
+    received = []
+    lora.add_listener(received.append)
+    assert lora.query(Command("MULTICASTALL", GET)) == [MULTICAST0, b"OK\r\n"]
+    assert received == [LRRECV]
+    assert lora.poll() == 1 # lines after OK are left for the listeners
+    assert received == [LRRECV, b"+STATUS:3\r\n"]
+
+
+def test_query_many_splits_responses(lora, fake_serial):
+    fake_serial.answers[b"AT+STATUS=?\r\n"] = [b"+STATUS:3\r\n", b"OK\r\n"]
+    fake_serial.answers[b"AT+DEVCLASS=?\r\n"] = [b"+ERROR:3\r\n"]
+    responses = lora.query_many([Command("STATUS", GET), Command("DEVCLASS", GET)])
+    assert len(fake_serial.written) == 1
+    assert responses == [[b"+STATUS:3\r\n", b"OK\r\n"], [b"+ERROR:3\r\n"]]
+
+
+def test_poll_waits_for_command_in_progress(lora, fake_serial):
+    received = []
+    lora.add_listener(received.append)
+    with lora._lock:
+        fake_serial.input.append(LRRECV)
+        poller = threading.Thread(target=lora.poll)
+        poller.start()
+        time.sleep(0.05)
+        assert poller.is_alive()
+        assert received == []
+    poller.join()
+    assert received == [LRRECV]
+
+
+def test_reader_thread_does_not_take_responses(lora, fake_serial):
+    fake_serial.answers[MULTICASTALL] = [MULTICAST0, b"OK\r\n"]
+    stream = DownlinkStream(lora, interval=0)
+    subscriber = stream.subscribe(maxlen=1024)
+    stream.start()
+    try:
+        for _ in range(200):
+            fake_serial.input.append(LRRECV)
+            assert lora.query(Command("MULTICASTALL", GET)) == [MULTICAST0, b"OK\r\n"]
+    finally:
+        stream.stop()
+    assert subscriber.received == 200
+
+
+def test_listener_error_does_not_break_query(lora, fake_serial):
+    fake_serial.answers[b"AT+STATUS=?\r\n"] = [LRRECV, b"+STATUS:3\r\n", b"OK\r\n"]
+    received = []
+
+    def failing(line):
+        raise ValueError("broken listener")
+
+    lora.add_listener(failing)
+    lora.add_listener(received.append)
+    assert lora.query(Command("STATUS", GET)) == [b"+STATUS:3\r\n", b"OK\r\n"]
+    assert received == [LRRECV]
@@ -0,0 +1,87 @@
+import pytest
+
+from m300h import ResponseError
+from multicast import MulticastManager
+
+SLOT0 = b"+MULTICAST0:1,0x0000ABCD,>FFEEDDCC8C7FC6CBC33D0809FB565001,>FFEEDDCC8C7FC6CBC33D0809FB565002,5\r\n"
+SLOT1 = b"+MULTICAST1:0,0x00000000,>00000000000000000000000000000000,>00000000000000000000000000000000,0\r\n"
+SLOT2 = b"+MULTICAST2:0,0x00000000,>00000000000000000000000000000000,>00000000000000000000000000000000,0\r\n"
+
+
+class FakeLora:
+    _debug = False
+
+    def __init__(self, set_answers):
+        self.set_answers = set_answers # answer of each MULTICASTn SET, in order
+        self.written = []
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def report(self, line):
+        for listener in self._listeners:
+            listener(line)
+
+    def query(self, command):
+        return [SLOT0, SLOT1, SLOT2, b"OK\r\n"]
+
+    def query_many(self, commands):
+        self.written.append([command.serialize() for command in commands])
+        return [self.set_answers.pop(0) for _ in commands]
+
+
+def test_commit_writes_changed_slots_in_one_batch():
+    lora = FakeLora([[b"OK\r\n"], [b"OK\r\n"]])
+    manager = MulticastManager(lora)
+    manager.refresh()
+    manager.allocate(0x1234, bytes(range(16)), bytes(16))
+    manager.allocate(0x5678, bytes(16), bytes(16))
+    assert [slot.index for slot in manager.commit()] == [1, 2]
+    assert len(lora.written) == 1 and len(lora.written[0]) == 2
+    assert lora.written[0][0] == "AT+MULTICAST1=1,0x00001234,>000102030405060708090A0B0C0D0E0F,>" + "00" * 16 + ",0\r\n"
+    assert manager.pending == []
+
+
+def test_rejected_slot_stays_pending():
+    lora = FakeLora([[b"+ERROR:4\r\n"], [b"OK\r\n"]])
+    manager = MulticastManager(lora)
+    manager.refresh()
+    manager.allocate(0x1234, bytes(16), bytes(16))
+    manager.allocate(0x5678, bytes(16), bytes(16))
+    with pytest.raises(ResponseError) as err:
+        manager.commit()
+    assert err.value.code == 4
+    assert [slot.index for slot in manager.pending] == [1]
+
+
+def test_no_answer_stays_pending():
+    manager = MulticastManager(FakeLora([[]]))
+    manager.refresh()
+    manager.allocate(0x1234, bytes(16), bytes(16))
+    with pytest.raises(ResponseError):
+        manager.commit()
+    assert [slot.index for slot in manager.pending] == [1]
+
+
+def test_lrrecv_on_bound_port_tracks_seq():
+    manager = MulticastManager(FakeLora([]))
+    manager.refresh()
+    manager.bind_port(0xABCD, 2)
+    manager._lora.report(b"^LRRECV:9,2,-44,29,2,<ABCD,923.2,2\r\n")
+    assert manager[0].seq == 9 and manager.pending == []
+    manager.close()
+    assert manager._lora._listeners == []
+
+
+def test_slot_report_keeps_uncommitted_changes():
+    manager = MulticastManager(FakeLora([]))
+    manager.refresh()
+    slot = manager.allocate(0x1234, bytes(16), bytes(16))
+    manager._lora.report(SLOT1.replace(b",0\r\n", b",3\r\n"))
+    manager._lora.report(SLOT0.replace(b",5\r\n", b",6\r\n"))
+    assert manager[1] is slot and [pending.index for pending in manager.pending] == [1]
+    assert manager[0].seq == 6
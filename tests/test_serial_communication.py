@@ -0,0 +1,65 @@
+import threading
+
+PROBE = b"AT+STATUS=?\r\n"
+LRRECV = b"^LRRECV:1,22,-44,29,2,<ABCD,923.2,2\r\n"
+
+
+class BaudSerial:
+    """
+    Fake port answering the probe only at one baud rate.
+    """
+
+    def __init__(self, fake_serial, baudrate):
+        self.__dict__["_fake"] = fake_serial
+        self.__dict__["_baudrate"] = baudrate
+
+    def __getattr__(self, name):
+        return getattr(self._fake, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._fake, name, value)
+        answer = [b"+STATUS:3\r\n", b"OK\r\n"] if self._fake.baudrate == self._baudrate else []
+        self._fake.answers[PROBE] = answer
+
+
+def test_negotiate_picks_fastest_answering_rate(lora, fake_serial):
+    lora._serial_object = BaudSerial(fake_serial, 38400)
+    assert lora.negotiate_baudrate() == 38400
+    assert lora.baudrate == fake_serial.baudrate == 38400
+
+
+def test_negotiate_restores_baudrate_when_nothing_answers(lora, fake_serial):
+    lora._serial_object = BaudSerial(fake_serial, 1200)
+    assert lora.negotiate_baudrate() is None
+    assert lora.baudrate == fake_serial.baudrate == 9600
+
+
+def test_probe_keeps_waiting_reports(lora, fake_serial):
+    fake_serial.answers[PROBE] = [LRRECV, b"+STATUS:3\r\n", b"OK\r\n"]
+    fake_serial.input.append(b"^LRCONFIRM:1,-128,10,481.5,0\r\n")
+    received = []
+    lora.add_listener(received.append)
+    assert lora.probe()
+    assert received == [b"^LRCONFIRM:1,-128,10,481.5,0\r\n", LRRECV]
+
+
+def test_negotiate_holds_port_lock(lora, fake_serial):
+    free = []
+
+    def try_lock():
+        if lora._lock.acquire(blocking=False):
+            lora._lock.release()
+            free.append(True)
+        else:
+            free.append(False)
+
+    class CheckingSerial(BaudSerial):
+        def __setattr__(self, name, value):
+            other = threading.Thread(target=try_lock) # another thread must not get the port meanwhile
+            other.start()
+            other.join()
+            super().__setattr__(name, value)
+
+    lora._serial_object = CheckingSerial(fake_serial, 1200)
+    assert lora.negotiate_baudrate() is None
+    assert free and not any(free)
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from tracelog import INBOUND, OUTBOUND, TRACE_HEADER, TRACE_MAGIC, TraceReader, TraceRecorder
+
+LRRECV = b"^LRRECV:%d,22,-44,29,2,<ABCD,923.2,2\r\n"
+
+
+def write(recorder, count):
+    for seq in range(count):
+        recorder.record(OUTBOUND if seq % 2 else INBOUND, LRRECV % seq)
+
+
+def test_seek_by_time(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    recorder = TraceRecorder(path, index_interval=4, index_block=2)
+    write(recorder, 50)
+    middle = time.monotonic_ns()
+    write(recorder, 10)
+    recorder.close()
+    with TraceReader(path) as reader:
+        assert len(list(reader)) == 60
+        assert len(reader._index) == 15 # one entry every 4 records
+        records = list(reader.records(start=middle))
+        assert [record.command.seq for record in records] == list(range(10))
+        assert records[1].direction == OUTBOUND
+
+
+def test_live_trace_is_readable(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    recorder = TraceRecorder(path, index_interval=4, index_block=2)
+    with TraceReader(path) as reader: # only the header so far
+        assert list(reader) == []
+    write(recorder, 41)
+    with TraceReader(path) as reader: # never closed: index blocks + flush at every index entry
+        assert len(list(reader)) == 40
+        assert len(reader._index) == 10
+    recorder.close()
+
+
+def test_file_shorter_than_header(tmp_path):
+    path = tmp_path / "trace.bin"
+    path.write_bytes(b"M3")
+    with TraceReader(str(path)) as reader:
+        assert list(reader.records(start=0)) == []
+
+
+def test_other_version_is_reported(tmp_path):
+    path = tmp_path / "trace.bin"
+    path.write_bytes(TRACE_HEADER.pack(TRACE_MAGIC, 1, 0, 0, 0, 0, 256))
+    with pytest.raises(ValueError, match="version 1"):
+        TraceReader(str(path))
+
+
+def test_readlines_traces_every_line(lora, fake_serial, tmp_path):
+    path = str(tmp_path / "trace.bin")
+    lora.start_trace(path)
+    fake_serial.input.extend([LRRECV % 1, LRRECV % 2])
+    assert lora.readlines() == [LRRECV % 1, LRRECV % 2]
+    lora.stop_trace()
+    with TraceReader(path) as reader:
+        records = list(reader)
+        assert [record.data for record in records] == [LRRECV % 1, LRRECV % 2]
+        assert records[0].timestamp < records[1].timestamp